@@ -9,21 +9,67 @@ Created on 2020/8/5
 """
 # import spaic
 
-from collections import OrderedDict
+import sys
+from collections import deque
+from itertools import chain, islice
+import numpy as np
+from copy import deepcopy
 from .BaseModule import BaseModule, VariableAgent
 # from .Topology import Projection, Connection
 from ..Backend.Backend import Backend
 # from ..Neuron.Neuron import NeuronGroup
 # from ..Neuron.Node import Node
 from abc import ABC, abstractmethod
-from torch import nn
-from typing import List
-import inspect
 
 from .. import global_assembly_context_list, global_assembly_init_count
 from .. import global_assembly_context_omit_start, global_assembly_context_omit_end
 global global_assembly_context_list, global_assembly_init_count
 
+# value types that can't be member assemblies, connections or projections
+_PLAIN_VALUE_TYPES = frozenset((bool, int, float, str, type(None), tuple, list, dict, set))
+
+def _fast_deepcopy(value, memo):
+    '''
+    Deep copy an attribute value for structure_copy: immutable scalars are shared, arrays and tensors are copied
+    directly as one buffer, anything else goes through deepcopy with the shared memo so references are kept.
+    '''
+    value_type = type(value)
+    if value is None or value_type in (bool, int, float, str):
+        return value
+    # a memo entry can be None (the backend is mapped to None)
+    copied = memo.get(id(value), memo)
+    if copied is not memo:
+        return copied
+    if value_type is np.ndarray:
+        copied = value.copy()
+    else:
+        # torch is imported by the backends, it is looked up here so this module doesn't import it
+        torch = sys.modules.get('torch')
+        if torch is not None and value_type in (torch.Tensor, torch.nn.Parameter):
+            copied = value.detach().clone()
+            if value_type is torch.nn.Parameter:
+                copied = torch.nn.Parameter(copied, requires_grad=value.requires_grad)
+            else:
+                copied.requires_grad_(value.requires_grad)
+        else:
+            return deepcopy(value, memo)
+    memo[id(value)] = copied
+    return copied
+
+
+# Topology and Neuron import this module, so their classes are imported on first use and kept here
+_member_classes = None
+
+
+def _get_member_classes():
+    global _member_classes
+    if _member_classes is None:
+        from ..Network.Topology import Connection, Projection
+        from ..Neuron.Neuron import NeuronGroup
+        from ..Neuron.Node import Node
+        _member_classes = (Connection, Projection, NeuronGroup, Node)
+    return _member_classes
+
 # class ContextMetaClass(type):
 #
 #     def __call__(self, *args, **kwargs):
@@ -54,20 +100,39 @@ class Assembly(BaseModule):
         Attributes:
             _class_label(str): the label is a static variable to imply the class of this object
             _backend(Backend): the backend backend this assembly runs on
-            _groups(OrderedDict): the container of member assemblies
-            _connections(OrderedDict): the container of member connections
+            _groups(dict): the container of member assemblies
+            _connections(dict): the container of member connections
+            _group_keys(dict): reverse map from member assembly to its key in _groups
+            _conn_keys(dict): reverse map from member connection to its key in _connections
             _supers(list): the super assemblies that add this assembly as their member assemblies
-            _input_connections(list): the connections that use this assembly as post-synaptic target
-            _output_connections(list): the connections that use this assembly as pre-synaptic target
+            _input_connections(dict): the connections that use this assembly as post-synaptic target
+            _output_connections(dict): the connections that use this assembly as pre-synaptic target
             num(int): the total number of neurons this assembly contains
             position(Tuple(int, int)): the top level positon of this assembly
             _var_names: The backend variable names this assembly and its members contains
+            _struct_version(int): the structure epoch shared by all assemblies, increased by every structure change
+            _cache(dict): memoized traversal results, valid only while _cache_version equals _struct_version
+            _dup_suffix(dict): the last suffix number used for each duplicated member key in merge_assembly
+            _descendants(set): all member assemblies of this assembly at any depth
+            _conns_by_endpoint(dict): map from an assembly to the member connections linked to it
 
 
     """
 
     _class_label = '<asb>'
     _is_terminal = False
+    _struct_version = 0
+    # internal indexes and caches live in slots; the public attributes stay in __dict__ for the network saver
+    # the module sets are copied with them so they stay in step with the copied module lists
+    _STRUCTURE_INDEXES = ('_group_keys', '_conn_keys', '_dup_suffix', '_descendants', '_conns_by_endpoint',
+                          '_input_module_set', '_output_module_set')
+    # attributes that structure_copy leaves to the __init__ of the copy
+    _STRUCTURE_COPY_SKIP = frozenset(('name', '_supers', '_input_connections', '_output_connections', '_backend'))
+    # released structure copies kept for reuse by structure_copy, per class
+    _clone_pool = dict()
+    _CLONE_POOL_SIZE = 16
+    __slots__ = _STRUCTURE_INDEXES + ('_cache', '_cache_version', '_var_names_cache', '_var_names_cache_ver',
+                                      '_super_counts')
 
     def __init__(self, name=None):
         '''Base class for  neural network units, and defines the basic attributes of a group object.
@@ -80,11 +145,13 @@ class Assembly(BaseModule):
 
         Attributes:
             _backend(Backend): the backend backend this assembly runs on
-            _groups(OrderedDict): the container of member assemblies
-            _connections(OrderedDict): the container of member connections
+            _groups(dict): the container of member assemblies
+            _connections(dict): the container of member connections
+            _group_keys(dict): reverse map from member assembly to its key in _groups
+            _conn_keys(dict): reverse map from member connection to its key in _connections
             _supers(list): the super assemblies that add this assembly as their member assemblies
-            _input_connections(list): the connections that use this assembly as post-synaptic target
-            _output_connections(list): the connections that use this assembly as pre-synaptic target
+            _input_connections(dict): the connections that use this assembly as post-synaptic target
+            _output_connections(dict): the connections that use this assembly as pre-synaptic target
             num(int): the total number of neurons this assembly contains
             position(Tuple(int, int)): the top level positon of this assembly
             _var_names: The backend variable names this assembly and its members contains
@@ -95,17 +162,33 @@ class Assembly(BaseModule):
 
         self.set_name(name)
         self._backend: Backend = None
-        # self._groups: OrderedDict[str, Assembly] = OrderedDict()
-        # self._connections: OrderedDict[str, Connection] = OrderedDict()
-        # self._projections: OrderedDict[str, Projection] = OrderedDict()
-        self._groups: OrderedDict[str] = OrderedDict()
-        self._connections: OrderedDict[str] = OrderedDict()
-        self._projections: OrderedDict[str] = OrderedDict()
+        # dict keeps insertion order (python>=3.7), so the member order is the same as the definition order
+        self._groups = dict()
+        self._connections = dict()
+        self._projections = dict()
+        # reverse maps (object -> key) for identity lookups of members, hashed by object identity
+        self._group_keys = dict()
+        self._conn_keys = dict()
+        self._cache = dict()
+        self._cache_version = -1
+        self._var_names_cache = None
+        self._var_names_cache_ver = None
+        self._dup_suffix = dict()
+        # all member assemblies at any depth, kept up to date on add/remove so that containment is a set lookup
+        self._descendants = set()
+        # member connections indexed by their pre and post assemblies
+        self._conns_by_endpoint = dict()
         self._supers = list()
-        self._input_connections = list()
-        self._output_connections = list()
+        # membership counts of the super assemblies, a super that adds this assembly twice is listed twice
+        self._super_counts = dict()
+        # registered connections keyed by the connection, dict keeps the registering order
+        self._input_connections = dict()
+        self._output_connections = dict()
         self._input_modules = list()
         self._output_modules = list()
+        # membership sets for the registered modules, the lists keep the registering order
+        self._input_module_set = set()
+        self._output_module_set = set()
         self.num = 0
         self.position = None
         self.model_name = None
@@ -172,12 +255,10 @@ class Assembly(BaseModule):
             >>> TestAsb = Assembly()
             >>> TestAsb.add_assembly(name='layer1', assembly=Assembly())
         """
-
-        if self._backend: self._backend.builded = False
-
-        assert assembly not in self._groups.values(), "assembly %s is already in the assembly %s"%(name, self.name)
+        # __setattr__ marks the structure as changed, no need to do it here
+        assert assembly not in self._group_keys, "assembly %s is already in the assembly %s"%(name, self.name)
         assert name not in self._groups, "assembly with name: %s have the same name with assembly already in the assembly %s"%(name, self.name)
-        self.__setattr__(name, assembly)
+        setattr(self, name, assembly)
 
     def del_assembly(self, assembly=None, name=None):
         """
@@ -202,29 +283,31 @@ class Assembly(BaseModule):
             >>> TestAsb = Assembly() # assuming contains neurongroups and network structure
             >>> TestAsb.del_assembly(name='layer1')
         """
-        if self._backend: self._backend.builded = False
+        self._dirty()
 
         if assembly is not None:
-            deleted_assembly = False
-            for gkey, value in self._groups.items():
-                if value is assembly:
-                    del self._groups[gkey]
-                    del self.__dict__[gkey]
-                    deleted_assembly = True
-            assert deleted_assembly, " try to delete an assembly that is not in the group"
-
-            for ckey in self._connections.keys():
-                if self._connections[ckey].assembly_linked(assembly):
-                    del self._connections[ckey]
-
+            assert assembly in self._group_keys, " try to delete an assembly that is not in the group"
+            # an assembly stored under several keys is deleted under all of them
+            for gkey in self._member_keys(assembly):
+                del self._groups[gkey]
+                del self.__dict__[gkey]
+                if self in assembly._super_counts:
+                    assembly.del_super(self)
+            del self._group_keys[assembly]
         elif name is not None:
             assert name in self._groups, " try to delete an assembly that is not in the group"
-            assembly = self._groups[name]
-            del self._groups[name]
+            assembly = self._groups.pop(name)
             del self.__dict__[name]
-            for ckey in self._connections.keys():
-                if self._connections[ckey].assembly_linked(assembly):
-                    del self._connections[ckey]
+            self._unkey_group(assembly, name)
+            if self in assembly._super_counts:
+                assembly.del_super(self)
+        else:
+            return
+        self._refresh_descendants()
+
+        for con in self._linked_connections(assembly, pop=True):
+            self._unindex_connection(con)
+            del self._connections[self._conn_keys.pop(con)]
 
     def add_connection(self, name, connection):
         """
@@ -243,7 +326,6 @@ class Assembly(BaseModule):
             >>> TestAsb.add_connection(name='con1', connection=Connection(self.layer1, self.layer2, link_type='full'))
 
         """
-        if self._backend: self._backend.builded = False
         # assert connection.pre in self.get_groups(), 'pre %s is not in the group' % connection.pre.name
         # assert connection.post in self.get_groups(), 'post %s is not in the group' % connection.post.name
         if name in self._connections:
@@ -253,7 +335,7 @@ class Assembly(BaseModule):
                 raise ValueError("duplicated name for the connection")
         else:
             # self._connections[name] = connection
-            self.__setattr__(name, connection)
+            setattr(self, name, connection)
 
     def del_connection(self, connection=None, name=None):
         """
@@ -279,20 +361,19 @@ class Assembly(BaseModule):
             >>> TestAsb = Assembly()
             >>> TestAsb.del_connection(name='con1')
         """
-        if self._backend: self._backend.builded = False
+        self._dirty()
         if connection is not None:
-            deleted_connection = False
-            for ckey, value in self._connections.items():
-                if value is connection:
-                    dict.__getitem__()
-                    del self._connections[ckey]
-                    del self.__dict__[ckey]
-                    deleted_connection = True 
-            assert deleted_connection,  " try to delete an connection that is not in the group"
+            assert connection in self._conn_keys, " try to delete an connection that is not in the group"
+            ckey = self._conn_keys.pop(connection)
+            del self._connections[ckey]
+            del self.__dict__[ckey]
+            self._unindex_connection(connection)
         elif name is not None:
             assert name in self._connections, " try to delete an connection that is not in the group"
-            del self._connections[name]
+            connection = self._connections.pop(name)
+            self._conn_keys.pop(connection, None)
             del self.__dict__[name]
+            self._unindex_connection(connection)
 
     def add_projection(self, name, projection):
         """
@@ -311,16 +392,15 @@ class Assembly(BaseModule):
             >>> TestAsb.add_projection(name='prj1', projection=Projection(self.layer1, self.layer2, link_type='full'))
 
         """
-        if self._backend: self._backend.builded = False
-        assert projection.pre in self._groups.values(), 'pre %s is not in the group' % projection.pre.name
-        assert projection.post in self._groups.values(), 'post %s is not in the group' % projection.post.name
+        assert projection.pre in self._group_keys, 'pre %s is not in the group' % projection.pre.name
+        assert projection.post in self._group_keys, 'post %s is not in the group' % projection.post.name
         if name in self._projections:
             if projection is self._projections[name]:
                 raise ValueError(" projection is already in the assembly's projection list")
             else:
                 raise ValueError("duplicated name for the projection")
         else:
-            self.__setattr__(name, projection)
+            setattr(self, name, projection)
 
     def copy_assembly(self, name, assembly):
         """
@@ -342,9 +422,8 @@ class Assembly(BaseModule):
             >>> Asb2 = Assembly() # assuming it contains neurongroups and network structure
             >>> Asb1.copy_assembly(name='layer2', assembly=Asb2)
         """
-        if self._backend: self._backend.builded = False
         rv = assembly.structure_copy(name)
-        self.__setattr__(name, rv)
+        setattr(self, name, rv)
 
     def replace_assembly(self, old_assembly, new_assembly):
         """
@@ -366,18 +445,70 @@ class Assembly(BaseModule):
             >>> asb2 = Assembly() # assuming it contains neurongroups and network structure
             >>> templateAsb.replace_assembly(templateAsb.asb1, asb2)
         """
-        if self._backend: self._backend.builded = False
-        replaced_assembly = False
-        for gkey in self._groups.keys():
-            if self._groups[gkey] is old_assembly:
-                self._groups[gkey] = new_assembly
-                self.__dict__[gkey] = new_assembly
-                replaced_assembly = True
-        assert replaced_assembly, " try to repalce an assembly that is not in the group"
+        self._dirty()
+        assert old_assembly in self._group_keys, " try to repalce an assembly that is not in the group"
+        # an assembly stored under several keys is replaced under all of them
+        for gkey in self._member_keys(old_assembly):
+            self._groups[gkey] = new_assembly
+            self.__dict__[gkey] = new_assembly
+            self._group_keys.setdefault(new_assembly, gkey)
+            if self in old_assembly._super_counts:
+                old_assembly.del_super(self)
+            new_assembly.add_super(self)
+        del self._group_keys[old_assembly]
+        self._refresh_descendants()
+
+        for con in self._linked_connections(old_assembly, pop=True):
+            self._unindex_connection(con)
+            con.replace_assembly(old_assembly, new_assembly)
+            self._index_connection(con)
+
+    def _member_keys(self, assembly):
+        '''
+        Return all keys of a member assembly in _groups. The super counts of the member tell if it is stored
+        under more than one key, only then _groups is scanned.
+        '''
+        if assembly._super_counts.get(self, 0) > 1:
+            return [gkey for gkey, value in self._groups.items() if value is assembly]
+        return [self._group_keys[assembly]]
+
+    def _unkey_group(self, assembly, gkey):
+        '''
+        Update the reverse map after the key gkey of a member assembly is removed from _groups.
+        A member that is still stored under another key is mapped to the first remaining one.
+        Must be called before the super of the member is deleted.
+        '''
+        if self._group_keys.get(assembly) != gkey:
+            return
+        del self._group_keys[assembly]
+        if assembly._super_counts.get(self, 0) > 1:
+            for key, value in self._groups.items():
+                if value is assembly:
+                    self._group_keys[assembly] = key
+                    break
+
+    def _dirty(self):
+        """
+        Mark the structure of this assembly as changed: advance the structure epoch and unbuild the backend.
+        """
+        Assembly._struct_version += 1
+        backend = self._backend
+        if backend is not None and backend.builded:
+            backend.builded = False
 
-        for con in self._connections.values():
-            if con.assembly_linked(old_assembly):
-                con.replace_assembly(old_assembly, new_assembly)
+    def _dup_key(self, key, container):
+        """
+        Return the next free duplicated name ``key(n)`` for the container, continuing from the last suffix
+        handed out for this key so repeated merges do not re-probe the taken suffixes.
+        """
+        n = self._dup_suffix.get(key, 0) + 1
+        while True:
+            tmp_key = f"{key}({n})"
+            if tmp_key not in container:
+                break
+            n += 1
+        self._dup_suffix[key] = n
+        return tmp_key
 
     def merge_assembly(self, assembly):
         """
@@ -396,33 +527,37 @@ class Assembly(BaseModule):
             >>> test_asb = Assembly() # assuming it contains neurongroups and network structure
             >>> test_asb.merge_assembly(target_asb)
         """
-        if self._backend: self._backend.builded = False
+        self._dirty()
 
-        for key, value in assembly._groups.item():
+        for key, value in assembly._groups.items():
             if key in self._groups:
                 # for the different sub_assembly with different name:
                 if value is not self._groups[key]:
                     # set a duplicated name with suffix (1),(2),(3),...
-                    for num in range(1, 1000):
-                        tmp_key = key + '(' + str(num) +')'
-                        if tmp_key not in self._groups:
-                            self._groups[tmp_key] = value
-                            break
+                    tmp_key = self._dup_key(key, self._groups)
+                    self._groups[tmp_key] = value
+                    self._group_keys.setdefault(value, tmp_key)
+                    value.add_super(self)
+                    self._add_descendants(value)
             else:
                 # for the sub_assembly that is not in self
                 self._groups[key] = value
+                self._group_keys.setdefault(value, key)
+                value.add_super(self)
+                self._add_descendants(value)
 
-        for key, value in assembly._connections.item():
+        for key, value in assembly._connections.items():
             if key in self._connections:
                 if value is not self._connections[key]:
                     # set a duplicated name with suffix (1),(2),(3),...
-                    for num in range(1, 1000):
-                        tmp_key = key + '(' + str(num) +')'
-                        if tmp_key not in self._connections:
-                            self._connections[tmp_key] = value
-                            break
+                    tmp_key = self._dup_key(key, self._connections)
+                    self._connections[tmp_key] = value
+                    self._conn_keys[value] = tmp_key
+                    self._index_connection(value)
             else:
                 self._connections[key] = value
+                self._conn_keys[value] = key
+                self._index_connection(value)
 
     def select_assembly(self, assemblies, name=None, with_connection=True):
         """
@@ -442,31 +577,26 @@ class Assembly(BaseModule):
             >>> newAsb1 = testAsb.select_assembly(['asb1', 'asb2'], 'newAsb') # using names
             >>> newAsb2 = testAsb.select_assembly([testAsb.asb2, testAsb.asb3], 'newAsb') # using assembly objects
         """
-        if self._backend: self._backend.builded = False
+        self._dirty()
         new_asb = Assembly(name)
         for asb in assemblies:
             if isinstance(asb, str):
-                asb_name= asb
-                if asb_name in self._groups:
-                    asb = self._groups[asb_name]
-                    new_asb.add_assembly(asb_name, asb)
-                    if with_connection:
-                        for key, con in self._connections.items():
-                            if con.assembly_linked(asb):
-                                new_asb.add_connection(key, con)
-                else:
-                    ValueError("No assembly name in the groups")
+                gkey = asb
+                if gkey not in self._groups:
+                    raise ValueError("No assembly name in the groups")
+                asb = self._groups[gkey]
             else:
                 assert isinstance(asb, Assembly), "selected object that is not Assembly"
-                for gkey, value in self._groups:
-                    if value is asb:
-                        new_asb.add_assembly(asb.name, asb)
-                        if with_connection:
-                            for key, con in self._connections.items():
-                                if con.assembly_linked(asb):
-                                    new_asb.add_connection(key, con)
-                else:
-                    ValueError("No assembly in the groups")
+                gkey = self._group_keys.get(asb)
+                if gkey is None:
+                    raise ValueError("No assembly in the groups")
+            new_asb.add_assembly(gkey, asb)
+            if with_connection:
+                for con in self._linked_connections(asb):
+                    # a connection between two selected assemblies is only added once
+                    key = self._conn_keys[con]
+                    if key not in new_asb._connections:
+                        new_asb.add_connection(key, con)
 
         return new_asb
 
@@ -474,7 +604,7 @@ class Assembly(BaseModule):
         """
         Prohibit this assembly from building and display, but keep this assembly for later use.
 
-        The set this assembly and its member assemblies with the flag hided = True.
+        Set this assembly, its member assemblies and their connections with the flag enabled = False.
 
         Returns:
             None
@@ -483,12 +613,12 @@ class Assembly(BaseModule):
             >>> TestAsb = Assembly()
             >>> TestAsb.assembly_hide()
         """
-        if self._backend: self._backend.builded = False
-        self.enabled = False
-        for key, value in self._groups.items():
-            value.assembly_hide()
-        for key, value in self._connections.items():
-            value.enabled = False
+        self._dirty()
+        # flat pass over the descendant set instead of recursing into every member
+        for asb in (self, *self._descendants):
+            asb.enabled = False
+            for con in asb._connections.values():
+                con.enabled = False
 
     def assembly_show(self):
         """
@@ -502,12 +632,12 @@ class Assembly(BaseModule):
         >>> TestAsb.assembly_show()
 
         """
-        if self._backend: self._backend.builded = False
-        self.enabled = True
-        for key, value in self._groups.items():
-            value.assembly_show()
-        for key, value in self._connections.items():
-            value.enabled = True
+        self._dirty()
+        # flat pass over the descendant set instead of recursing into every member
+        for asb in (self, *self._descendants):
+            asb.enabled = True
+            for con in asb._connections.values():
+                con.enabled = True
 
     def get_groups(self, recursive=True):
         """
@@ -520,10 +650,19 @@ class Assembly(BaseModule):
 
         """
         if self._groups and recursive:
-            all_groups = []
-            for g in self._groups.values():
-                all_groups.extend(g.get_groups(recursive))
-            return all_groups
+            all_groups = self._get_cache('groups')
+            if all_groups is None:
+                # depth-first walk with an explicit stack, members are pushed reversed to keep their order
+                all_groups = []
+                stack = list(reversed(list(self._groups.values())))
+                while stack:
+                    g = stack.pop()
+                    if g._groups:
+                        stack.extend(reversed(list(g._groups.values())))
+                    elif not (g._class_label == '<asb>' or g._class_label == '<net>'):
+                        all_groups.append(g)
+                self._cache['groups'] = all_groups
+            return list(all_groups)
         elif self._groups and not recursive:
             return list(self._groups.values())
         elif self._class_label == '<asb>' or self._class_label == '<net>':
@@ -537,18 +676,19 @@ class Assembly(BaseModule):
         Returns:
 
         """
-        if self._is_terminal:
-            return [[self]]
-        else:
-            leveled_groups = [[self]]
-            for k, g in self._groups.items():
-                new_level_groups = g.get_leveled_groups()
-                for level, groups in enumerate(new_level_groups):
-                    level += 1
-                    if level < len(leveled_groups):
-                        leveled_groups[level].extend(groups)
-                    else:
-                        leveled_groups.append(groups)
+        # breadth-first walk, the groups of each level keep the order of their super assemblies
+        leveled_groups = [[self]]
+        frontier = deque([(self, 0)])
+        while frontier:
+            group, level = frontier.popleft()
+            if group._is_terminal or not group._groups:
+                continue
+            level += 1
+            if level == len(leveled_groups):
+                leveled_groups.append([])
+            for g in group._groups.values():
+                leveled_groups[level].append(g)
+                frontier.append((g, level))
         return leveled_groups
 
     def get_assemblies(self, recursive=True, include_empty=False):
@@ -561,15 +701,31 @@ class Assembly(BaseModule):
             list of all member assemblies
         """
 
+        # type of recursive is in the key, since True and 1 have the same hash but different meanings
+        cache_key = ('assemblies', type(recursive), recursive, include_empty)
+        all_assemblies = self._get_cache(cache_key)
+        if all_assemblies is not None:
+            return all_assemblies.copy()
+
         if type(recursive) is int:
             # use recursive as a level label
             recursive -= 1
 
         if self._groups and recursive:
             all_assemblies = {self,}
-            for g in self._groups.values():
-                all_assemblies.update(g.get_assemblies(recursive, include_empty))
-            return all_assemblies
+            stack = [(g, recursive) for g in self._groups.values()]
+            while stack:
+                asb, level = stack.pop()
+                if type(level) is int:
+                    level -= 1
+                if asb._groups:
+                    all_assemblies.add(asb)
+                    if level:
+                        stack.extend((g, level) for g in asb._groups.values())
+                elif include_empty:
+                    all_assemblies.add(asb)
+            self._cache[cache_key] = all_assemblies
+            return all_assemblies.copy()
         elif self._groups and not recursive:
             return {self}
         elif not self._groups and include_empty:
@@ -586,10 +742,7 @@ class Assembly(BaseModule):
         Returns:
             the key of target assembly
         """
-        for gkey in self._groups.keys():
-            if self._groups[gkey] is assembly:
-                return gkey
-        return False
+        return self._group_keys.get(assembly, False)
 
     def get_super_assemblies(self, assembly):
         """
@@ -602,7 +755,7 @@ class Assembly(BaseModule):
         """
         if len(self._groups) == 0:
             return []
-        elif assembly in self._groups.values():
+        elif assembly in self._group_keys:
             return [self]
         else:
             for g in self._groups.values():
@@ -615,17 +768,85 @@ class Assembly(BaseModule):
 
     def __contains__(self, item):
         if isinstance(item, Assembly):
-            if item is self:
-                return True
-            elif item in self._groups.values():
-                return True
-            else:
-                for g in self._groups.values():
-                    if item in g:
-                        return True
-                return False
+            return item is self or item in self._descendants
         else:
-            return item in self._connections.values()
+            return item in self._conn_keys
+
+    def _add_descendants(self, assembly):
+        '''
+        Add a new member assembly and its descendants to the descendant sets of this assembly and all its super assemblies.
+        '''
+        added = {assembly}
+        added |= assembly._descendants
+        stack = [self]
+        while stack:
+            asb = stack.pop()
+            if added <= asb._descendants:
+                continue
+            asb._descendants |= added
+            stack.extend(asb._supers)
+
+    def _refresh_descendants(self):
+        '''
+        Rebuild the descendant sets of this assembly and all its super assemblies after members were removed or replaced.
+        '''
+        stack = [self]
+        while stack:
+            asb = stack.pop()
+            descendants = set()
+            for g in asb._groups.values():
+                descendants.add(g)
+                descendants |= g._descendants
+            if descendants == asb._descendants:
+                continue
+            asb._descendants = descendants
+            stack.extend(asb._supers)
+
+    def _index_connection(self, connection):
+        '''
+        Add a member connection to the endpoint index under its pre and post assemblies.
+        '''
+        self._conns_by_endpoint.setdefault(connection.pre, []).append(connection)
+        if connection.post is not connection.pre:
+            self._conns_by_endpoint.setdefault(connection.post, []).append(connection)
+
+    def _linked_connections(self, assembly, pop=False):
+        '''
+        Return the member connections the endpoint index holds for the assembly that still link it.
+        A connection shared with another assembly may have been re-pointed there, so the entries are checked
+        against the connection and the ones that no longer match are left in the index.
+        Args:
+            assembly: the endpoint assembly
+            pop: remove the returned connections from the index
+        '''
+        indexed = self._conns_by_endpoint.get(assembly)
+        if not indexed:
+            return []
+        conn_keys = self._conn_keys
+        linked = []
+        kept = []
+        for con in indexed:
+            if con in conn_keys and con.assembly_linked(assembly):
+                linked.append(con)
+            else:
+                kept.append(con)
+        if pop:
+            if kept:
+                self._conns_by_endpoint[assembly] = kept
+            else:
+                del self._conns_by_endpoint[assembly]
+        return linked
+
+    def _unindex_connection(self, connection):
+        '''
+        Remove a member connection from the endpoint index.
+        '''
+        for endpoint in (connection.pre, connection.post):
+            linked = self._conns_by_endpoint.get(endpoint)
+            if linked is not None and connection in linked:
+                linked.remove(connection)
+                if not linked:
+                    del self._conns_by_endpoint[endpoint]
 
     def get_connections(self, recursive=True):
         """
@@ -639,42 +860,91 @@ class Assembly(BaseModule):
         if not recursive:
             return list(self._connections.values())
         else:
-            all_assmblies = self.get_assemblies(recursive=2)
-            connections = list()
-            connections = self.update_connection(connections, self._connections)
-            # connections.update(self._connections.values())
-            for asb in all_assmblies:
-                if asb is self:
-                    # connections.update(asb.get_connections(recursive=False))
-                    connections = self.update_connection(connections, asb.get_connections(recursive=False))
-                else:
-                    # connections.update(asb.get_connections(recursive=True))
-                    connections = self.update_connection(connections, asb.get_connections(recursive=True))
-            for proj in self._projections.values():
-                # connections.update(proj.get_connections(recursive=True))
-                connections = self.update_connection(connections, proj.get_connections(recursive=True))
+            connections = list(self._get_member_connections())
+            seen = None
+            # the connections of projections are generated at build time, so they are not cached
+            for asb in self.get_assemblies(recursive=True):
+                for proj in asb._projections.values():
+                    if seen is None:
+                        seen = set(connections)
+                    connections = self.update_connection(connections, proj.get_connections(recursive=True), seen)
             return connections
-    def update_connection(self, container, connections):
+
+    def _get_member_connections(self):
+        # member connections of this assembly and all its member assemblies, memoized until the structure changes
+        connections = self._get_cache('connections')
+        if connections is None:
+            connections = list(self._connections.values())
+            # one set for the whole loop, so each connection is hashed once at this level
+            seen = set(connections)
+            for g in self._groups.values():
+                connections = self.update_connection(connections, g._get_member_connections(), seen)
+            self._cache['connections'] = connections
+        return connections
+
+    @property
+    def num(self):
+        '''
+        The total number of neurons of the member assemblies, computed when read and cached until the members change.
+        An assembly without members has its own assigned number.
+        '''
+        if not self._groups:
+            return self.__dict__.get('num', 0)
+        num = self._get_cache('num')
+        if num is None:
+            num = sum(g.num for g in self._groups.values())
+            self._cache['num'] = num
+        return num
+
+    @num.setter
+    def num(self, value):
+        # the own number is kept in __dict__, where the network saver reads it
+        self.__dict__['num'] = value
+        # the sums cached by the super assemblies are out of date, a super caches its sum only after its members did
+        stack = list(self._supers)
+        while stack:
+            asb = stack.pop()
+            if asb._cache.pop('num', None) is not None:
+                stack.extend(asb._supers)
+
+    def _get_cache(self, key):
+        if self._cache_version != Assembly._struct_version:
+            # the structure has changed since the results were cached
+            self._cache.clear()
+            self._cache_version = Assembly._struct_version
+        return self._cache.get(key)
+
+    def update_connection(self, container, connections, contained=None):
         assert isinstance(container, list)
-        if isinstance(connections, OrderedDict):
-            for con in connections.values():
-                if con not in container:
-                    container.append(con)
-        elif isinstance(connections, list):
-            for con in connections:
-                if con not in container:
-                    container.append(con)
-        else:
+        if isinstance(connections, dict):
+            connections = connections.values()
+        elif not isinstance(connections, list):
             raise ValueError("connections type not right")
+        if not connections:
+            return container
+        # connections hash by identity, so a set of the container replaces the linear scan of the list,
+        # names are not used as keys since connections in different assemblies may share a name.
+        # a caller that merges several lists passes the set kept for the container along
+        if contained is None:
+            contained = set(container)
+        for con in connections:
+            if con not in contained:
+                contained.add(con)
+                container.append(con)
         return container
 
 
     def get_var_names(self):
         """
-        Get a list of variable names the assembly member contains.
+        Get a tuple of variable names the assembly member contains.
 
         """
-        return self._var_names
+        # variable names are only appended while building, so the snapshot is renewed when the length changes
+        version = (Assembly._struct_version, len(self._var_names))
+        if self._var_names_cache_ver != version:
+            self._var_names_cache = tuple(self._var_names)
+            self._var_names_cache_ver = version
+        return self._var_names_cache
 
     def get_str(self, level):
         """
@@ -685,18 +955,22 @@ class Assembly(BaseModule):
         Returns:
             String representations
         """
+        buf = []
+        self._collect_str(level, buf)
+        return ''.join(buf)
 
-        level_space = "" + '-'*level
-        repr_str = level_space + "|name:{}, type:{}, ".format(self.name, type(self).__name__)
-        repr_str += "total_neuron_num:{}\n ".format(self.num)
+    def _collect_str(self, level, buf):
+        """
+        Append the string descriptions of this assembly and its members to buf, joined once by get_str
+        """
+        buf.append(f"{'-' * level}|name:{self.name}, type:{type(self).__name__}, total_neuron_num:{self.num}\n ")
         level += 1
         for g in self._groups.values():
-            repr_str += g.get_str(level)
+            g._collect_str(level, buf)
         for c in self._connections.values():
-            repr_str += c.get_str(level)
+            c._collect_str(level, buf)
         for p in self._projections.values():
-            repr_str += p.get_str(level)
-        return repr_str
+            p._collect_str(level, buf)
 
     # back-end functions
     def build(self, backend=None, strategy=0):
@@ -736,25 +1010,15 @@ class Assembly(BaseModule):
         if self.id is not None:
             return self.id
 
-        if len(self._supers) == 0:
-            self.id = self.name + self.__class__._class_label
+        # ids are used as dict keys all over the backend, so they are built once and interned
+        own_id = self.name + self.__class__._class_label
+        super_ids = [sup.id if sup.id is not None else sup.set_id() for sup in self._supers]
+        if len(super_ids) == 0:
+            self.id = sys.intern(own_id)
+        elif len(super_ids) == 1:
+            self.id = sys.intern(super_ids[0] + '_' + own_id)
         else:
-            super_ids = []
-            for super in self._supers:
-                if super.id is not None:
-                    super_ids.append(super.id)
-                else:
-                    super_ids.append(super.set_id())
-
-            self.id = self.name + self.__class__._class_label
-            if len(super_ids) == 1:
-                self.id = super_ids[0] + '_' + self.id
-            else:
-                pre_id = '/'
-                for prefix in super_ids:
-                    pre_id += prefix + ','
-                pre_id += '/'
-                self.id = pre_id + '_' + self.id
+            self.id = sys.intern('/' + ','.join(super_ids) + ',/_' + own_id)
         return self.id
 
     def register_connection(self, connection_obj, presynaptic):
@@ -777,18 +1041,35 @@ class Assembly(BaseModule):
         #             i._input_connections.append(connection_obj)
         # # connection_obj.post_groups
         if presynaptic:
-            if connection_obj not in self._output_connections:
-                self._output_connections.append(connection_obj)
+            self.register_connections(presynaptic_connections=(connection_obj,))
         else:
-            if connection_obj not in self._input_connections:
-                self._input_connections.append(connection_obj)
+            self.register_connections(postsynaptic_connections=(connection_obj,))
+
+    def register_connections(self, presynaptic_connections=(), postsynaptic_connections=()):
+        '''
+        Register many input and output connections of this assembly at once
+        Args:
+            presynaptic_connections (Iterable[Connection]): the connections that use this assembly as pre-synaptic target
+            postsynaptic_connections (Iterable[Connection]): the connections that use this assembly as post-synaptic target
+        Returns:
+            None
+
+        '''
+        output_connections = self._output_connections
+        for connection_obj in presynaptic_connections:
+            output_connections.setdefault(connection_obj, connection_obj)
+        input_connections = self._input_connections
+        for connection_obj in postsynaptic_connections:
+            input_connections.setdefault(connection_obj, connection_obj)
 
     def register_module(self, module_obj, pre):
         if pre:
-            if module_obj not in self._output_modules:
+            if module_obj not in self._output_module_set:
+                self._output_module_set.add(module_obj)
                 self._output_modules.append(module_obj)
         else:
-            if module_obj not in self._input_modules:
+            if module_obj not in self._input_module_set:
+                self._input_module_set.add(module_obj)
                 self._input_modules.append(module_obj)
 
 
@@ -801,18 +1082,106 @@ class Assembly(BaseModule):
         Returns:
             the new assembly
         """
-        # define a new object but remain the structure
-        from copy import deepcopy
-        rv = self.__class__.__new__(self.__class__)
-        rv.__init__(name)
-        tmp_dict = deepcopy(self.__dict__)
-        del tmp_dict['name']
-        del tmp_dict['_supers']
-        del tmp_dict['_input_connections']
-        del tmp_dict['_output_connections']
-        rv.__dict__.update(tmp_dict)
+        # define a new object but remain the structure, reuse a released copy of the same class if there is one
+        pool = Assembly._clone_pool.get(self.__class__)
+        if pool:
+            rv = pool.pop()
+            rv.set_name(name)
+        else:
+            rv = self.__class__.__new__(self.__class__)
+            rv.__init__(name)
+        # the members refer back to this assembly through their supers, which become the copy,
+        # and the copied structure is not bound to the backend
+        memo = {id(self): rv}
+        for unit in chain((self,), self._descendants, self._get_member_connections()):
+            backend = unit._backend
+            if backend is not None:
+                memo[id(backend)] = None
+        # the copied members start with empty connection registries, they are filled again when the copy is built
+        for asb in self._descendants:
+            memo[id(asb._input_connections)] = dict()
+            memo[id(asb._output_connections)] = dict()
+        # the units of the enclosing assemblies are shared, not copied, members built in a network refer to them
+        # through the operations and variables made at build time
+        if self._supers:
+            for unit in self._outer_units():
+                memo[id(unit)] = unit
+                backend = unit._backend
+                if backend is not None:
+                    memo[id(backend)] = None
+        # write straight into the dict of the copy, no intermediate dict is built
+        rv_dict = rv.__dict__
+        skip = Assembly._STRUCTURE_COPY_SKIP
+        for key, value in self.__dict__.items():
+            if key not in skip:
+                rv_dict[key] = _fast_deepcopy(value, memo)
+        # the member indexes are slots, copy them with the same memo so they refer to the copied members
+        for index_name in Assembly._STRUCTURE_INDEXES:
+            setattr(rv, index_name, deepcopy(getattr(self, index_name), memo))
         return rv
 
+    def _outer_units(self):
+        '''
+        Return the assemblies and connections of the assemblies that enclose this one, except this assembly
+        and its own members.
+        '''
+        inner = set(self._descendants)
+        inner.add(self)
+        outer = set()
+        stack = list(self._supers)
+        while stack:
+            asb = stack.pop()
+            if asb in outer:
+                continue
+            outer.add(asb)
+            if asb._supers:
+                stack.extend(asb._supers)
+            else:
+                # a top assembly holds every unit below it
+                outer.update(asb._descendants)
+                outer.update(asb._get_member_connections())
+        outer.difference_update(inner)
+        outer.difference_update(self._get_member_connections())
+        return outer
+
+    @classmethod
+    def release_clone(cls, assembly):
+        '''
+        Give a structure copy that is no longer used back to structure_copy for reuse.
+        The assembly must not be a member of other assemblies and must not be used after it is released.
+        Args:
+            assembly: the released structure copy
+        '''
+        assert isinstance(assembly, Assembly), "the released object is not Assembly"
+        assert not assembly._supers, "can't release an assembly that is still a member of other assemblies"
+        pool = cls._clone_pool.setdefault(assembly.__class__, [])
+        if len(pool) < cls._CLONE_POOL_SIZE and all(a is not assembly for a in pool):
+            # cleared now, so the pool doesn't keep the members and values of the released copy alive
+            assembly._reset()
+            pool.append(assembly)
+
+    def _reset(self):
+        '''
+        Clear a released structure copy to the state structure_copy expects, the containers are cleared in place
+        '''
+        self_dict = self.__dict__
+        kept = dict()
+        for key in ('_supers', '_input_connections', '_output_connections'):
+            container = self_dict[key]
+            container.clear()
+            kept[key] = container
+        self_dict.clear()
+        self_dict.update(kept)
+        self_dict['_backend'] = None
+        self_dict['name'] = None
+        for index_name in Assembly._STRUCTURE_INDEXES:
+            getattr(self, index_name).clear()
+        self._super_counts.clear()
+        self._cache.clear()
+        self._cache_version = -1
+        self._var_names_cache = None
+        self._var_names_cache_ver = None
+
     def add_super(self, assembly):
         '''
         Tell this assemlby  the target assembly is it's super assembly
@@ -820,6 +1189,7 @@ class Assembly(BaseModule):
             assembly: the target super assembly
         '''
         assert isinstance(assembly, Assembly), "the super is not Assembly"
+        self._super_counts[assembly] = self._super_counts.get(assembly, 0) + 1
         self._supers.append(assembly)
 
     def del_super(self, assembly):
@@ -829,7 +1199,10 @@ class Assembly(BaseModule):
             assembly: the target super assembly
 
         """
-        assert  assembly in self._supers, "the assembly is not in supers"
+        assert  assembly in self._super_counts, "the assembly is not in supers"
+        count = self._super_counts.pop(assembly)
+        if count > 1:
+            self._super_counts[assembly] = count - 1
         self._supers.remove(assembly)
 
 
@@ -854,8 +1227,13 @@ class Assembly(BaseModule):
         global_assembly_context_list.append(self)
         main_vars = vars(__main__)
         NoInMain = True
-        for key in main_vars:
-            value = main_vars[key]
+        # the variable of this assembly is usually the latest one bound in __main__, so search from the end
+        try:
+            main_items = reversed(main_vars.items())
+        except TypeError:
+            # dict views are reversible since python 3.8
+            main_items = reversed(list(main_vars.items()))
+        for key, value in main_items:
             if value is self:
                NoInMain = False
                self.set_name(key)
@@ -865,21 +1243,29 @@ class Assembly(BaseModule):
             raise ValueError("can only construct network using with at __main__")
         else:
             # record the variable number before enter the context
-            self.context_enterpoint = main_vars.__len__() -1
+            self.context_enterpoint = len(main_vars) - 1
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         import __main__
 
         global global_assembly_context_omit_start, global_assembly_context_omit_end
         main_vars = vars(__main__)
-        endpoint_num = main_vars.__len__() -1
+        endpoint_num = len(main_vars) - 1
 
         # depending on the feature that python >=3.7 , dict is insertion ordered, so we can get the subunits by order
-        for ind, key in enumerate(main_vars):
-            if ind > self.context_enterpoint and ind <= global_assembly_context_omit_start:
-                self.__setattr__(key, main_vars[key])
-            elif ind > self.context_enterpoint and ind > global_assembly_context_omit_end:
-                self.__setattr__(key, main_vars[key])
+        # the subunits are the variables defined after entering this context, except those already taken by the
+        # inner context between omit_start and omit_end
+        # islice skips the variables before the context in C, the bounds are clipped as islice only takes sys.maxsize
+        var_num = len(main_vars)
+        start = self.context_enterpoint + 1
+        omit_start = min(global_assembly_context_omit_start + 1, var_num)
+        omit_end = min(global_assembly_context_omit_end + 1, var_num)
+        subunits = chain(islice(main_vars.items(), start, max(start, omit_start)),
+                         islice(main_vars.items(), max(start, omit_start, omit_end), None))
+        for key, value in subunits:
+            # only the network units are taken, other variables of __main__ are left out
+            if isinstance(value, BaseModule):
+                setattr(self, key, value)
 
         global_assembly_context_list.pop()
         global_assembly_context_omit_start = self.context_enterpoint
@@ -889,41 +1275,71 @@ class Assembly(BaseModule):
 
     def __setattr__(self, name, value):
         super(Assembly, self).__setattr__(name, value)
-        from ..Network.Topology import Connection, Projection
-        from ..Neuron.Neuron import NeuronGroup
-        from ..Neuron.Node import Node
-        if (self.__class__ is NeuronGroup) or (issubclass(self.__class__, Node)):
-            # If class is NeuronGroup or the subclass of Node, do not add other object to it.
+        if type(value) in _PLAIN_VALUE_TYPES or not isinstance(value, BaseModule):
+            # plain values, tensors and other non-module values are never members, skip the member bookkeeping
+            return
+        Connection, Projection, NeuronGroup, Node = _get_member_classes()
+        # If class is NeuronGroup or the subclass of Node, do not add other object to it.
+        # The check is done once per class and kept in the class's own dict, a subclass doesn't inherit it.
+        cls = self.__class__
+        no_members = cls.__dict__.get('_no_members')
+        if no_members is None:
+            no_members = (cls is NeuronGroup) or issubclass(cls, Node)
+            cls._no_members = no_members
+        if no_members:
             return
 
         if isinstance(value, Assembly):
-            if self._backend: self._backend.builded = False
+            self._dirty()
             value.set_name(name)
+            replaced = self._groups.get(name)
             self._groups[name] = value
+            if replaced is not None:
+                self._unkey_group(replaced, name)
+                if self in replaced._super_counts:
+                    replaced.del_super(self)
+            # a member stored under several names keeps the first one as its key
+            self._group_keys.setdefault(value, name)
             # self.num += value.num
             value.add_super(self)
+            if replaced is None:
+                self._add_descendants(value)
+            else:
+                self._refresh_descendants()
         elif isinstance(value, Connection):
-            if self._backend: self._backend.builded = False
+            self._dirty()
+            if name in self._connections:
+                replaced = self._connections[name]
+                self._conn_keys.pop(replaced, None)
+                self._unindex_connection(replaced)
             self._connections[name] = value
+            self._conn_keys[value] = name
+            self._index_connection(value)
             value.set_name(name)
             value.add_super(self)
         elif isinstance(value, Projection):
             # if it is not Connection but belongs to projection (pure projection)
-            if self._backend: self._backend.builded = False
+            self._dirty()
             self._projections[name] = value
             value.set_name(name)
             value.add_super(self)
 
     def __delattr__(self, name):
         super(Assembly, self).__delattr__(name)
-        if name in self._groups:
-            if self._backend: self._backend.builded = False
-            self._groups[name].del_super(self)
-            del self._groups[name]
-        elif name in self._connections:
-            if self._backend: self._backend.builded = False
-            self._connections[name].del_super(self)
-            del self._connections[name]
+        # pop the member directly, one lookup for both the check and the removal
+        group = self._groups.pop(name, None)
+        if group is not None:
+            self._dirty()
+            self._unkey_group(group, name)
+            group.del_super(self)
+            self._refresh_descendants()
+            return
+        connection = self._connections.pop(name, None)
+        if connection is not None:
+            self._dirty()
+            connection.del_super(self)
+            self._conn_keys.pop(connection, None)
+            self._unindex_connection(connection)
 
     def __repr__(self):
 
@@ -76,7 +76,7 @@ class Network(Assembly):
     def add_learner(self, name, learner):
         from ..Learning.Learner import Learner
         assert isinstance(learner, Learner)
-        self.__setattr__(name, learner)
+        setattr(self, name, learner)
 
     # TODO: 这里的setattr是否有必要要，是否可以全部放到Assembly里？
     def __setattr__(self, name, value):
@@ -124,19 +124,25 @@ class Network(Assembly):
         con_debug = False
         con_syn_count = 0
 
+        # ----根据连接，对每个神经元建立input_connection和output_connection
+        # the connections are grouped by their end assemblies, so that each assembly registers them in one call
+        pre_connections = dict()
+        post_connections = dict()
         for con in all_connections:
             con.set_id()
-
-            # ----根据连接，对每个神经元建立input_connection和output_connection
-            con.pre.register_connection(con, True)
-            con.post.register_connection(con, False)
+            pre_connections.setdefault(con.pre, []).append(con)
+            post_connections.setdefault(con.post, []).append(con)
+        for pre, cons in pre_connections.items():
+            pre.register_connections(presynaptic_connections=cons)
+        for post, cons in post_connections.items():
+            post.register_connections(postsynaptic_connections=cons)
 
         if strategy == 1:
-            # 采取单纯的从头递归地build，一旦出现环路会陷入死循环，可以避开固有延迟的问题,
-            # Use directly build strategy to avoid inherent delay. But cannot be used on models with loop, will fall in an endless loop.
+            # 采取单纯的从头按拓扑序build，可以避开固有延迟的问题，出现环路时环路上的连接以一步延迟构建,
+            # Use directly build strategy to avoid inherent delay. On models with loop, a connection of the loop is built with one step delay.
             # Unfortunately,
-            self.forward_build(all_groups, all_connections)
             self._backend.forward_build = True
+            self.forward_build(all_groups, all_connections)
         # elif strategy == 2:
         #     # 采取策略性构建，但是目前存在两个问题：
         #     #   1. 网络中存在Assembly块时会出现bug，尚未修复
@@ -191,65 +197,94 @@ class Network(Assembly):
         pass
 
     def forward_build(self, all_groups=None, all_connections=None):
-        builded_groups = []
-        builded_connections = []
+        # build the targets in topological order (Kahn's algorithm): a target is built once all of its unbuilt inputs
+        # are built. Encoders and generators are the sources, the other nodes are built at last.
+        unbuilt_targets = set(all_groups)
+        unbuilt_targets.update(all_connections)
+        source_groups = []
         nod_groups = []
-        for group in all_groups.copy():
+        for group in all_groups:
             if group._class_label == '<nod>':
+                unbuilt_targets.discard(group)
                 if (group._node_sub_class == '<encoder>') or (group._node_sub_class == '<generator>'):
-                    group.build(self._backend)
-                    builded_groups.append(group)
-                    all_groups.remove(group)
-                    for conn in group._output_connections:
-                        self.deep_forward_build(conn, all_groups, all_connections, builded_groups, builded_connections)
-                    for module in group._output_modules:
-                        self.deep_forward_build(module, all_groups, all_connections, builded_groups,
-                                                builded_connections)
+                    source_groups.append(group)
                 else:
-                    all_groups.remove(group)
                     nod_groups.append(group)
 
-        while all_groups or all_connections:
-            for group in all_groups:
-                self.deep_forward_build(group, all_groups, all_connections, builded_groups, builded_connections)
-            for conn in all_connections:
-                self.deep_forward_build(conn, all_groups, all_connections, builded_groups, builded_connections)
+        in_degrees = dict()
+        for target in unbuilt_targets:
+            inputs, _ = self.forward_build_links(target)
+            in_degrees[target] = len(unbuilt_targets.intersection(inputs))
+
+        # ready targets are popped from a stack, so the build order follows the outputs depth first
+        ready_targets = []
+
+        def build_target(target):
+            target.build(self._backend)
+            counted = target in unbuilt_targets
+            unbuilt_targets.discard(target)
+            _, outputs = self.forward_build_links(target)
+            ready = []
+            for po in dict.fromkeys(outputs):
+                if po in unbuilt_targets:
+                    # only the inputs that were unbuilt at the start are counted in the in-degrees
+                    if counted:
+                        in_degrees[po] -= 1
+                    if in_degrees[po] == 0:
+                        ready.append(po)
+            ready_targets.extend(reversed(ready))
+
+        def build_ready():
+            while ready_targets:
+                target = ready_targets.pop()
+                if target in unbuilt_targets:
+                    build_target(target)
+
+        def build_from(target):
+            build_target(target)
+            build_ready()
+
+        all_targets = all_groups + all_connections
+        for group in source_groups:
+            build_from(group)
+        for target in all_targets:
+            if target in unbuilt_targets and in_degrees[target] == 0:
+                build_from(target)
+
+        while unbuilt_targets:
+            # the rest targets are on or behind loops, walk back along the unbuilt inputs until a target repeats
+            target = next(t for t in all_targets if t in unbuilt_targets)
+            path = dict()
+            while target not in path:
+                path[target] = len(path)
+                inputs, _ = self.forward_build_links(target)
+                target = next(pr for pr in inputs if pr in unbuilt_targets)
+            loop = list(path)[path[target]:]
+            # break the loop at a connection, which is built to take the output of the last step
+            cut = next((t for t in loop if t._class_label == '<con>'), loop[0])
+            warn("Loop occurs in the network, %s is built with one step delay" % cut.name)
+            # only the cut is built with the delay, the targets after it are built forward again
+            forward_build = self._backend.forward_build
+            self._backend.forward_build = False
+            build_target(cut)
+            self._backend.forward_build = forward_build
+            build_ready()
 
         for group in nod_groups:
             group.build(self._backend)
-            builded_groups.append(group)
 
-    def deep_forward_build(self, target, all_groups, all_connections, builded_groups, builded_connections):
-        if (target in builded_groups) or (target in builded_connections):
-            return
+    @staticmethod
+    def forward_build_links(target):
+        # the (inputs, outputs) targets of a target in the forward build graph
         if target._class_label == '<con>':
-            pre = [target.pre]
-            post = [target.post]
-        elif target._class_label == '<neg>':
-            pre = target._input_connections + target._input_modules
-            post = target._output_connections + target._output_modules
+            return [target.pre], [target.post]
+        elif target._class_label == '<neg>' or target._class_label == '<nod>':
+            return ([*target._input_connections.values(), *target._input_modules],
+                    [*target._output_connections.values(), *target._output_modules])
         elif target._class_label == '<mod>':
-            pre = target.input_targets.copy()
-            post = target.output_targets.copy()
+            return target.input_targets, target.output_targets
         else:
-            raise ValueError("Deep forward build Error, unsupported class label.")
-
-        for pr in pre:
-            if (pr in all_groups) or (pr in all_connections):
-                return
-
-        target.build(self._backend)
-        if target._class_label == '<con>':
-            builded_connections.append(target)
-            all_connections.remove(target)
-        elif (target._class_label == '<neg>') or (target._class_label == '<mod>'):
-            builded_groups.append(target)
-            all_groups.remove(target)
-
-        for po in post:
-            self.deep_forward_build(po, all_groups, all_connections, builded_groups, builded_connections)
-
-        return
+            raise ValueError("Forward build Error, unsupported class label.")
 
     # def strategy_build(self, all_groups=None):
     #     builded_groups = []
@@ -375,7 +410,7 @@ class Network(Assembly):
         assert name not in self._monitors.keys(), "monitor with name: %s have the same name with an already exists monitor" % (
             name)
 
-        self.__setattr__(name, monitor)
+        setattr(self, name, monitor)
         # self._monitors[name] = monitor
 
     def get_elements(self):
@@ -143,7 +143,7 @@ class Projection(BaseModule):
 
         con.set_name(name)
         if con.is_unit:
-            self.__setattr__(name, con)
+            setattr(self, name, con)
             # self._connections[key] = con
         else:
             self._projections[key] = con
@@ -307,18 +307,18 @@ class Projection(BaseModule):
         return list(self._leaf_connections.values())
 
     def get_str(self, level):
+        buf = []
+        self._collect_str(level, buf)
+        return ''.join(buf)
 
+    def _collect_str(self, level, buf):
         # TODO: add str of subconnections
-        level_space = "" + '-' * level
-        repr_str = level_space + "|name:{}, type:{}, ".format(self.name, type(self).__name__)
-        repr_str += "pre:{}, ".format(self.pre.name)
-        repr_str += "post:{}\n ".format(self.post.name)
+        buf.append(f"{'-' * level}|name:{self.name}, type:{type(self).__name__}, pre:{self.pre.name}, post:{self.post.name}\n ")
         level += 1
         for c in self._projections.values():
-            repr_str += c.get_str(level)
+            c._collect_str(level, buf)
         for c in self._connections.values():
-            repr_str += c.get_str(level)
-        return repr_str
+            c._collect_str(level, buf)
 
     def train(self, mode=True):
         self.training = mode
@@ -573,7 +573,7 @@ class Connection(Projection):
             else:
                 raise ValueError("only support set synapse model with string")
 
-    def __new__(cls, pre, post, name=None, link_type=('full', 'sparse_connection', 'conv', '...'),
+    def __new__(cls, pre=None, post=None, name=None, link_type=('full', 'sparse_connection', 'conv', '...'),
                 syn_type=None, max_delay=0, sparse_with_mask=False, pre_var_name='O', post_var_name='Isyn',
                 syn_kwargs=None, **kwargs):
         if cls is not Connection:
@@ -659,14 +659,12 @@ class Connection(Projection):
         return self.id
 
     def get_str(self, level):
+        return f"{'-' * level}|name:{self.name}, type:{type(self).__name__}, pre:{self.pre.name}, post:{self.post.name}\n "
 
-        level_space = "" + '-' * level
-        repr_str = level_space + "|name:{}, type:{}, ".format(self.name, type(self).__name__)
-        repr_str += "pre:{}, ".format(self.pre.name)
-        repr_str += "post:{}\n ".format(self.post.name)
+    def _collect_str(self, level, buf):
+        buf.append(self.get_str(level))
         # for c in self._connections.values():
-        #     repr_str += c.get_str(level)
-        return repr_str
+        #     c._collect_str(level, buf)
 
     def set_delay(self, pre_group, post_group):
         # TODO: add to unit_connections information after it changed to List[dict]